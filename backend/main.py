@@ -1,23 +1,39 @@
 from fastapi import FastAPI, HTTPException, Request, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_validator
 from rag_engine import RAGEngine
 from twilio_handler import TwilioIVRHandler
 from whatsapp_handler import WhatsAppHandler
-from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
+from cachetools import TTLCache
+import asyncio
+import functools
+import hashlib
 import os
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO)
+_log_queue = queue.SimpleQueue()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[QueueHandler(_log_queue)])
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
 logger = logging.getLogger(__name__)
 
+class _StaticAccessFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        args = record.args
+        return not (isinstance(args, tuple) and len(args) > 2 and str(args[2]).startswith("/static/"))
+
+logging.getLogger("uvicorn.access").addFilter(_StaticAccessFilter())
+
 load_dotenv()
 
-app = FastAPI(title="RAG API", version="1.0.0")
+app = FastAPI(title="RAG API", version="1.0.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,9 +43,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-import os as os_module
-static_dir = os_module.path.join(os_module.path.dirname(__file__), 'static')
-os_module.makedirs(static_dir, exist_ok=True)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+static_dir = os.path.join(os.path.dirname(__file__), 'static')
+if not os.path.isdir(static_dir):
+    os.makedirs(static_dir, exist_ok=True)
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 pdf_dir = os.getenv("PDF_DATA_DIR", "./data/documents")
@@ -41,38 +59,95 @@ whatsapp_handler = WhatsAppHandler(rag_engine)
 
 twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-twilio_client = Client(twilio_account_sid, twilio_auth_token) if twilio_account_sid and twilio_auth_token else None
+_TWILIO_AUTH = (twilio_account_sid, twilio_auth_token) if twilio_account_sid else None
+
+@functools.lru_cache(maxsize=1)
+def get_twilio_client():
+    if not (twilio_account_sid and twilio_auth_token):
+        return None
+    from twilio.rest import Client
+    return Client(twilio_account_sid, twilio_auth_token)
+
+_BASE_URL = os.getenv("RENDER_EXTERNAL_URL", "https://rag-phone-bot.onrender.com").rstrip('/')
+_AUDIO_URL_FMT = f"{_BASE_URL}/static/audio/{{}}"
+
+_query_cache = TTLCache(maxsize=1024, ttl=3600)
+
+def _query_cache_key(query: str) -> bytes:
+    return hashlib.blake2b(query.strip().lower().encode(), digest_size=16).digest()
+
+WHATSAPP_MAX_LENGTH = 1600
+
+def _render_message(text: str) -> bytes:
+    response = MessagingResponse()
+    response.message(text)
+    return str(response).encode()
+
+_HELP_XML = _render_message("Please send a text message or voice note with your question!")
+_ERROR_XML = _render_message("Sorry, I encountered an error. Please try again.")
+_LOADING_XML = _render_message("⏳ The knowledge base is still loading. Please try again in a minute.")
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= WHATSAPP_MAX_LENGTH else text[:WHATSAPP_MAX_LENGTH - 3] + "..."
 
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True, extra='forbid')
+    
     query: str
+    
+    @field_validator('query')
+    @classmethod
+    def query_not_empty(cls, value: str) -> str:
+        if not value:
+            raise ValueError("query must not be empty")
+        return value
 
 class QueryResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid')
+    
     answer: str
     context: list
     num_sources: int
 
 @app.on_event("startup")
 async def startup_event():
-    print("🚀 Starting RAG API...")
-    print(f"📁 PDF Directory: {pdf_dir}")
-    print(f"💾 Vector Index Path: {index_path}")
+    logger.info("🚀 Starting RAG API...")
+    logger.info("📁 PDF Directory: %s", pdf_dir)
+    logger.info("💾 Vector Index Path: %s", index_path)
     
     if not os.getenv("GEMINI_API_KEY"):
-        print("⚠️  WARNING: GEMINI_API_KEY not set in .env file")
+        logger.warning("⚠️  WARNING: GEMINI_API_KEY not set in .env file")
     else:
-        print("✅ Gemini API Key configured")
+        logger.info("✅ Gemini API Key configured")
     
-    print("\n📚 Auto-ingesting PDFs...")
+    logger.info("📚 Auto-ingesting PDFs in background...")
+    app.state.ingest_task = asyncio.create_task(asyncio.to_thread(rag_engine.ingest_pdfs, pdf_dir))
+    app.state.ingest_task.add_done_callback(_log_ingest_result)
+    app.state.audio_janitor = asyncio.create_task(whatsapp_handler.audio_janitor())
+    app.state.connection_warmer = asyncio.create_task(whatsapp_handler.keep_connections_warm())
+
+def _log_ingest_result(task: asyncio.Task):
+    if task.cancelled():
+        logger.warning("⚠️  Auto-ingestion cancelled")
+        return
     try:
-        result = rag_engine.ingest_pdfs(pdf_dir)
+        result = task.result()
         if result["status"] == "success":
-            print(f"✅ Successfully ingested {result['count']} chunks from PDFs")
+            logger.info("✅ Index holds %d chunks from PDFs (%d added)", result['count'], result['added'])
         elif result["status"] == "warning":
-            print(f"⚠️  {result['message']}")
+            logger.warning("⚠️  %s", result['message'])
         else:
-            print(f"ℹ️  {result['message']}")
+            logger.info("ℹ️  %s", result['message'])
     except Exception as e:
-        print(f"❌ Auto-ingestion failed: {e}")
+        logger.error("❌ Auto-ingestion failed: %s", e)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.audio_janitor.cancel()
+    app.state.connection_warmer.cancel()
+    await rag_engine.aclose()
+    await whatsapp_handler.aclose()
+    _log_listener.stop()
 
 @app.get("/")
 async def root():
@@ -87,35 +162,57 @@ async def debug_index():
     if not rag_engine.metadata:
         return {"count": 0, "documents": []}
     
-    documents = list(set([m['source'] for m in rag_engine.metadata]))
+    documents = list(rag_engine.source_set)
     return {
         "count": len(rag_engine.metadata),
         "num_documents": len(documents),
         "documents": documents
     }
 
+def _index_loading() -> bool:
+    ingest_task = getattr(app.state, "ingest_task", None)
+    return not rag_engine.metadata and ingest_task is not None and not ingest_task.done()
+
+def _ensure_index_ready():
+    if _index_loading():
+        raise HTTPException(status_code=503, detail="Index is still being built. Please retry shortly.")
+
 @app.get("/clear_index")
 async def clear_index():
-    rag_engine.clear_index()
+    _ensure_index_ready()
+    await asyncio.to_thread(rag_engine.clear_index)
+    _query_cache.clear()
     return {"status": "success", "message": "Index cleared. Call /ingest to rebuild."}
 
 @app.post("/ingest")
 async def ingest_pdfs():
+    _ensure_index_ready()
     try:
-        result = rag_engine.ingest_pdfs(pdf_dir)
+        result = await asyncio.to_thread(rag_engine.ingest_pdfs, pdf_dir)
+        _query_cache.clear()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/query")
 async def query(request: QueryRequest):
+    _ensure_index_ready()
+    
+    key = _query_cache_key(request.query)
+    cached = _query_cache.get(key)
+    if cached is not None:
+        return QueryResponse(**cached)
+    
     try:
-        result = rag_engine.query(request.query)
-        return QueryResponse(
-            answer=result["answer"],
-            context=result["context"],
-            num_sources=len(result["sources"])
-        )
+        result = await rag_engine.query_async(request.query)
+        response = {
+            "answer": result["answer"],
+            "context": result["context"],
+            "num_sources": len(result["sources"])
+        }
+        if result.get("generated"):
+            _query_cache[key] = response
+        return QueryResponse(**response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -139,55 +236,53 @@ async def whatsapp_incoming(
     MediaContentType0: str = Form(None),
     MediaUrl0: str = Form(None)
 ):
-    logger.info(f"Received WhatsApp message from {From}")
+    logger.info("Received WhatsApp message from %s", From)
     
     response = MessagingResponse()
     
+    if (Body or NumMedia) and _index_loading():
+        return Response(content=_LOADING_XML, media_type="application/xml")
+    
     try:
-        if NumMedia > 0 and MediaContentType0 and 'audio' in MediaContentType0 and MediaUrl0:
+        if NumMedia and MediaUrl0 and (MediaContentType0 or '').lower().startswith('audio/'):
             logger.info("Processing voice message...")
             
             response.message("⏳ Awaiting response...")
             
-            auth = (twilio_account_sid, twilio_auth_token)
-            result = whatsapp_handler.process_voice_message(MediaUrl0, auth)
+            result = await whatsapp_handler.process_voice_message_async(MediaUrl0, _TWILIO_AUTH)
             
             
-            if result['transcription']:
-                if result.get('audio_file'):
-                    base_url = os.getenv("RENDER_EXTERNAL_URL", "https://rag-phone-bot.onrender.com")
-                    audio_url = f"{base_url}/static/audio/{result['audio_file']}"
-                    
-                    audio_msg = response.message()
-                    audio_msg.media(audio_url)
-                    
+            if result.get('audio_file'):
+                audio_url = _AUDIO_URL_FMT.format(result['audio_file'])
+                
+                audio_msg = response.message()
+                audio_msg.media(audio_url)
+                
+                if result['transcription']:
                     transcription_msg = f"🎤 You said: \"{result['transcription']}\""
                     msg = response.message(transcription_msg)
-                    
-                    logger.info(f"Sending audio + transcription: {audio_url}")
                 else:
-                    answer = result['text']
-                    if len(answer) > 1600:
-                        answer = answer[:1597] + "..."
-                    response.message(answer)
+                    response.message(result['text'][:WHATSAPP_MAX_LENGTH])
+                
+                logger.info("Sending audio + transcription: %s", audio_url)
+            elif result['transcription']:
+                response.message(_truncate(result['text']))
             else:
-                response.message(result['text'][:1600])
+                response.message(result['text'][:WHATSAPP_MAX_LENGTH])
         
         elif Body:
-            logger.info(f"Processing text message: {Body}")
-            answer = whatsapp_handler.process_text_message(Body)
-            if len(answer) > 1600:
-                answer = answer[:1597] + "..."
-            logger.info(f"Sending response: {answer[:100]}...")
+            logger.info("Processing text message: %s", Body)
+            answer = _truncate(await whatsapp_handler.process_text_message_async(Body))
+            logger.info("Sending response: %.100s...", answer)
             response.message(answer)
         
         else:
-            response.message("Please send a text message or voice note with your question!")
+            return Response(content=_HELP_XML, media_type="application/xml")
     except Exception as e:
-        logger.error(f"WhatsApp error: {e}")
-        response.message("Sorry, I encountered an error. Please try again.")
+        logger.error("WhatsApp error: %s", e)
+        return Response(content=_ERROR_XML, media_type="application/xml")
     
     response_str = str(response)
-    logger.info(f"TwiML response: {response_str[:200]}...")
+    logger.info("TwiML response: %.200s...", response_str)
     
     return Response(content=response_str, media_type="application/xml")
@@ -1,154 +1,491 @@
 import os
+import re
+import json
+import gzip
+import hashlib
+import sqlite3
+import asyncio
 import requests
-import pickle
-from typing import List, Dict
-from PyPDF2 import PdfReader
+import httpx
+from requests.adapters import HTTPAdapter
+import orjson
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterator, Optional, Tuple
+import pypdfium2 as pdfium
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from scipy.sparse.linalg import norm as sparse_norm
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
 from dotenv import load_dotenv
+from semantic_cache import SemanticCache
 
 load_dotenv()
 
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8").lower()
+
+def quantize_int8(vectors):
+    vectors = vectors.tocsr().astype(np.float32)
+    scales = np.asarray(abs(vectors).max(axis=1).todense()).ravel() / 127
+    row_scales = np.repeat(scales, np.diff(vectors.indptr))
+    vectors.data = np.clip(np.round(vectors.data / row_scales), -127, 127).astype(np.int8)
+    vectors.eliminate_zeros()
+    return vectors, scales.astype(np.float32)
+
+PROMPT_PREFIX = """You are a helpful AI assistant that answers questions based ONLY on the provided knowledge base.
+
+CRITICAL RULES:
+1. ONLY use information from the knowledge base provided below
+2. If the answer is not in the knowledge base, say: "I don't have this information in the knowledge base provided."
+3. Be concise and direct - this is for WhatsApp messaging
+4. Keep responses under 500 characters when possible
+5. Use simple language, avoid jargon
+6. Do NOT make up information or use external knowledge
+7. Always refer to the source as "knowledge base" not "document"
+
+KNOWLEDGE BASE:
+"""
+PROMPT_MIDDLE = """
+
+USER QUESTION: """
+PROMPT_SUFFIX = """
+
+YOUR ANSWER (concise, knowledge base only):"""
+
+GEMINI_ORIGIN = "https://generativelanguage.googleapis.com/"
+
+GEMINI_HTTP2 = os.getenv("GEMINI_HTTP2", "true").lower() == "true"
+
+GEMINI_GZIP_MIN_BYTES = int(os.getenv("GEMINI_GZIP_MIN_BYTES", "0"))
+
+WORD_PATTERN = re.compile(r'\S+')
+
+PDF_EXTRACT_MAX_WORKERS = int(os.getenv("PDF_EXTRACT_MAX_WORKERS", "8"))
+
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT = float(os.getenv("QUERY_BATCH_MAX_WAIT", "0.008"))
+
+HASHING_N_FEATURES = int(os.getenv("HASHING_N_FEATURES", str(2 ** 18)))
+INCREMENTAL_INGEST_MAX_RATIO = float(os.getenv("INCREMENTAL_INGEST_MAX_RATIO", "0.2"))
+
+DEFAULT_PARSER_RULES = [{"max_pages": None, "strategy": "sequential"}]
+
+def load_parser_rules(path: str) -> List[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)["rules"]
+    except Exception as e:
+        print(f"⚠️  Could not load PDF parser rules from {path}: {e}")
+        return DEFAULT_PARSER_RULES
+
+def calculate_optimal_workers(num_batches: int) -> int:
+    return max(1, min(os.cpu_count() or 1, num_batches))
+
+def _extract_pages(pdf: pdfium.PdfDocument, start: int, end: int) -> str:
+    return "".join(pdf[i].get_textpage().get_text_range() + "\n" for i in range(start, end))
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> str:
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return _extract_pages(pdf, start, end)
+    finally:
+        pdf.close()
+
+def build_vectorizer() -> Pipeline:
+    return Pipeline([
+        ("hash", HashingVectorizer(
+            n_features=HASHING_N_FEATURES, alternate_sign=False, norm=None,
+            stop_words='english', dtype=np.float32
+        )),
+        ("tfidf", TfidfTransformer(sublinear_tf=True))
+    ])
+
+CACHE_VECTORIZER = HashingVectorizer(
+    n_features=2 ** 20, ngram_range=(1, 2), alternate_sign=False, norm='l2', dtype=np.float32
+)
+
+def restore_vectorizer(idf: np.ndarray) -> Pipeline:
+    vectorizer = build_vectorizer()
+    vectorizer.named_steps["tfidf"].idf_ = idf
+    return vectorizer
+
+def inverse_row_norms(vectors) -> np.ndarray:
+    norms = sparse_norm(vectors.astype(np.float32), axis=1)
+    inverse = np.zeros_like(norms, dtype=np.float32)
+    np.divide(1.0, norms, out=inverse, where=norms > 0, casting='unsafe')
+    return inverse
+
+def select_parser_rule(rules: List[Dict], num_pages: int) -> Dict:
+    for rule in rules:
+        if rule.get("max_pages") is None or num_pages <= rule["max_pages"]:
+            return rule
+    return rules[-1]
+
+def extract_pdf_text(pdf_path: str, rules: List[Dict], allow_process_pool: bool = True) -> str:
+    try:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            num_pages = len(pdf)
+            rule = select_parser_rule(rules, num_pages)
+            if rule["strategy"] != "process" or not allow_process_pool:
+                return _extract_pages(pdf, 0, num_pages)
+        finally:
+            pdf.close()
+        
+        batch_size = max(1, rule.get("batch_size", num_pages))
+        ranges = [(start, min(start + batch_size, num_pages)) for start in range(0, num_pages, batch_size)]
+        print(f"📖 {os.path.basename(pdf_path)}: {num_pages} pages, process extraction in {len(ranges)} batch(es)")
+        
+        with ProcessPoolExecutor(max_workers=calculate_optimal_workers(len(ranges)), mp_context=multiprocessing.get_context("forkserver")) as executor:
+            return "".join(executor.map(
+                _extract_page_range,
+                [pdf_path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges]
+            ))
+    except Exception as e:
+        print(f"Error reading PDF {pdf_path}: {e}")
+        return ""
+
+@contextmanager
+def atomic_write(path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 class RAGEngine:
     def __init__(self, index_path: str = "./vector_index"):
         self.index_path = index_path
-        self.vectorizer = TfidfVectorizer(max_features=None, stop_words='english')
-        
-        self.index_file = os.path.join(index_path, "vectors.pkl")
-        self.metadata_file = os.path.join(index_path, "metadata.pkl")
-        
-        if os.path.exists(self.index_file):
-            with open(self.index_file, 'rb') as f:
-                data = pickle.load(f)
-                self.vectors = data['vectors']
-                self.vectorizer = data['vectorizer']
-            with open(self.metadata_file, 'rb') as f:
-                self.metadata = pickle.load(f)
-        else:
-            self.vectors = None
-            self.metadata = []
-            os.makedirs(index_path, exist_ok=True)
+        self.vectorizer = build_vectorizer()
+        self.vector_scales = None
+        self.row_norms_inv = None
+        self.manifest = None
+        self.source_set = set()
+        self.query_cache = SemanticCache(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+            maxsize=int(os.getenv("SEMANTIC_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        )
+        
+        self.query_vector_cache = OrderedDict()
+        self.query_vector_cache_size = int(os.getenv("QUERY_VECTOR_CACHE_SIZE", "1024"))
+        self._query_vector_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._ingest_lock = threading.Lock()
+        
+        self.index_files = {
+            name: os.path.join(index_path, f"postings_{name}.npy") for name in ("data", "indices", "indptr")
+        }
+        self.vectorizer_file = os.path.join(index_path, "vectorizer.npz")
+        self.metadata_file = os.path.join(index_path, "metadata.json")
+        self.text_cache_file = os.path.join(index_path, "text_cache.sqlite")
+        
+        self.vectors = None
+        self.metadata = []
+        os.makedirs(index_path, exist_ok=True)
+        if all(os.path.exists(f) for f in (*self.index_files.values(), self.vectorizer_file, self.metadata_file)):
+            try:
+                self.load_index()
+            except Exception as e:
+                print(f"⚠️  Could not load persisted index, it will be rebuilt on ingest: {e}")
+                self.publish_index(build_vectorizer(), None, None, None, [], None)
+        
+        self.parser_rules = load_parser_rules(os.getenv(
+            "PDF_PARSER_RULES",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "smart_parser_rules.json")
+        ))
         
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
-        self.gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={self.gemini_api_key}"
+        self.gemini_url = f"{GEMINI_ORIGIN}v1beta/models/gemini-2.0-flash:generateContent?key={self.gemini_api_key}"
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.async_client = None
+        self._query_queue = None
+        self._query_batcher = None
+        self._pending_batches = set()
 
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        try:
-            reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"Error reading PDF {pdf_path}: {e}")
-            return ""
+        return extract_pdf_text(pdf_path, self.parser_rules)
+
+    def extract_texts(self, pdf_paths: List[str]) -> List[str]:
+        if len(pdf_paths) <= 1:
+            return [self.extract_text_from_pdf(path) for path in pdf_paths]
+        
+        max_workers = min(PDF_EXTRACT_MAX_WORKERS, os.cpu_count() or 1, len(pdf_paths))
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("forkserver")) as executor:
+            return list(executor.map(
+                extract_pdf_text,
+                pdf_paths,
+                [self.parser_rules] * len(pdf_paths),
+                [False] * len(pdf_paths)
+            ))
 
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        words = text.split()
-        chunks = []
+    def iter_chunks(self, text: str, chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+        step = chunk_size - overlap
+        window = deque(maxlen=chunk_size)
+        count = 0
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
+        for match in WORD_PATTERN.finditer(text):
+            window.append(match.span())
+            count += 1
+            if count >= chunk_size and (count - chunk_size) % step == 0:
+                yield text[window[0][0]:window[-1][1]]
         
-        return chunks
+        first_open = 0 if count < chunk_size else ((count - chunk_size) // step + 1) * step
+        for start in range(first_open, count, step):
+            yield text[window[start - (count - len(window))][0]:window[-1][1]]
+
+    def load_index(self):
+        with np.load(self.vectorizer_file) as data:
+            if 'terms' in data or len(data['idf']) != HASHING_N_FEATURES:
+                print("♻️  Persisted index was built with a different vectorizer, it will be rebuilt on ingest")
+                return
+            self.vectorizer = restore_vectorizer(data['idf'])
+            self.vector_scales = data['scales'] if 'scales' in data else None
+        with open(self.metadata_file, 'rb') as f:
+            data = orjson.loads(f.read())
+            self.metadata = data['chunks']
+            self.manifest = data['manifest']
+        self.vectors = self.load_vectors(len(self.metadata), HASHING_N_FEATURES)
+        scales_mismatch = self.vector_scales is not None and len(self.vector_scales) != len(self.metadata)
+        if scales_mismatch or (self.vectors.nnz and int(self.vectors.indices.max()) >= len(self.metadata)):
+            raise ValueError("persisted index files are inconsistent")
+        self.row_norms_inv = inverse_row_norms(self.vectors)
+        self.source_set = set(m['source'] for m in self.metadata)
+
+    def load_vectors(self, num_chunks: int, num_terms: int):
+        data, indices, indptr = (np.load(self.index_files[name], mmap_mode='r') for name in ("data", "indices", "indptr"))
+        vectors = sparse.csc_matrix((data, indices, indptr), shape=(num_chunks, num_terms), copy=False)
+        vectors.has_sorted_indices = True
+        return vectors
 
     def save_index(self):
-        with open(self.index_file, 'wb') as f:
-            pickle.dump({
-                'vectors': self.vectors,
-                'vectorizer': self.vectorizer
-            }, f)
-        with open(self.metadata_file, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        for name, path in self.index_files.items():
+            with atomic_write(path) as f:
+                np.save(f, getattr(self.vectors, name))
+        arrays = {'idf': self.vectorizer.named_steps["tfidf"].idf_}
+        if self.vector_scales is not None:
+            arrays['scales'] = self.vector_scales
+        with atomic_write(self.vectorizer_file) as f:
+            np.savez(f, **arrays)
+        with atomic_write(self.metadata_file) as f:
+            f.write(orjson.dumps({'manifest': self.manifest, 'chunks': self.metadata}))
+
+    def publish_index(self, vectorizer, vectors, vector_scales, row_norms_inv, metadata: List[Dict], manifest: Optional[Dict]):
+        with self._state_lock:
+            self.vectorizer = vectorizer
+            self.vectors = vectors
+            self.vector_scales = vector_scales
+            self.row_norms_inv = row_norms_inv
+            self.metadata = metadata
+            self.source_set = set(m['source'] for m in metadata)
+            self.manifest = manifest
+            self.query_cache.clear()
+            with self._query_vector_lock:
+                self.query_vector_cache.clear()
+
+    def index_snapshot(self):
+        with self._state_lock:
+            return self.vectorizer, self.vectors, self.row_norms_inv, self.metadata
 
     def clear_index(self):
-        self.metadata = []
-        self.vectors = None
-        if os.path.exists(self.index_file):
-            os.remove(self.index_file)
-        if os.path.exists(self.metadata_file):
-            os.remove(self.metadata_file)
+        with self._ingest_lock:
+            self._reset_index()
+
+    def _reset_index(self):
+        self.publish_index(build_vectorizer(), None, None, None, [], None)
+        for path in (*self.index_files.values(), self.vectorizer_file, self.metadata_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _connect_text_cache(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.text_cache_file)
+        conn.execute("CREATE TABLE IF NOT EXISTS pdf_text (hash TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        return conn
+
+    def load_cached_text(self, digest: str) -> Optional[str]:
+        try:
+            with closing(self._connect_text_cache()) as conn:
+                row = conn.execute("SELECT text FROM pdf_text WHERE hash = ?", (digest,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"⚠️  Text cache read failed: {e}")
+            return None
+
+    def store_cached_text(self, digest: str, text: str):
+        try:
+            with closing(self._connect_text_cache()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO pdf_text (hash, text) VALUES (?, ?)", (digest, text))
+        except sqlite3.Error as e:
+            print(f"⚠️  Text cache write failed: {e}")
 
     def ingest_pdfs(self, pdf_directory: str) -> Dict[str, int]:
+        with self._ingest_lock:
+            return self._ingest_pdfs(pdf_directory)
+
+    def _ingest_pdfs(self, pdf_directory: str) -> Dict[str, int]:
         if not os.path.exists(pdf_directory):
             os.makedirs(pdf_directory)
-            return {"status": "error", "message": "PDF directory created but empty", "count": 0}
-
-        self.clear_index()
+            return {"status": "error", "message": "PDF directory created but empty", "count": 0, "added": 0}
 
         pdf_files = [f for f in os.listdir(pdf_directory) if f.endswith('.pdf')]
+        manifest = {f: file_digest(os.path.join(pdf_directory, f)) for f in pdf_files}
+        manifest["__vector_quantization__"] = VECTOR_QUANTIZATION
+        
+        if self.vectors is not None and self.manifest == manifest:
+            print("✅ PDFs unchanged since last ingest, reusing persisted index")
+            return {
+                "status": "success",
+                "message": f"Index already up to date with {len(pdf_files)} PDF(s)",
+                "count": len(self.metadata),
+                "added": 0
+            }
+
+        previous = self.manifest or {}
+        appendable = self.vectors is not None and all(manifest.get(f) == d for f, d in previous.items())
 
         if not pdf_files:
-            return {"status": "warning", "message": "No PDF files found", "count": 0}
+            if not appendable:
+                self._reset_index()
+            return {"status": "warning", "message": "No PDF files found", "count": len(self.metadata), "added": 0}
 
-        all_chunks = []
-        total_chunks = 0
+        new_files = [f for f in pdf_files if f not in previous] if appendable else pdf_files
+        texts = {f: self.load_cached_text(manifest[f]) for f in new_files}
+        to_extract = [f for f in new_files if texts[f] is None]
+        extracted = self.extract_texts([os.path.join(pdf_directory, f) for f in to_extract])
+        for pdf_file, text in zip(to_extract, extracted):
+            texts[pdf_file] = text
+            if text:
+                self.store_cached_text(manifest[pdf_file], text)
+
+        metadata = list(self.metadata) if appendable else []
+        existing_chunks = len(metadata)
+        added_chunks = 0
+        seen_chunks = set(hashlib.blake2b(m['text'].encode(), digest_size=16).digest() for m in metadata)
+        duplicate_chunks = 0
         
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(pdf_directory, pdf_file)
-            
-            text = self.extract_text_from_pdf(pdf_path)
+        for pdf_file in new_files:
+            text = texts[pdf_file]
             if not text:
                 print(f"⚠️  WARNING: No text extracted from {pdf_file}")
                 continue
             
             print(f"✅ Extracted {len(text)} characters from {pdf_file}")
             
-            chunks = self.chunk_text(text)
-            
-            for idx, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                self.metadata.append({
+            for idx, chunk in enumerate(self.iter_chunks(text)):
+                digest = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+                if digest in seen_chunks:
+                    duplicate_chunks += 1
+                    continue
+                seen_chunks.add(digest)
+                metadata.append({
                     "text": chunk,
                     "source": pdf_file,
                     "chunk_id": idx
                 })
-                total_chunks += 1
+                added_chunks += 1
         
-        if all_chunks:
-            self.vectors = self.vectorizer.fit_transform(all_chunks)
-            print(f"✅ Vocabulary size: {len(self.vectorizer.vocabulary_)} unique terms")
+        if duplicate_chunks:
+            print(f"♻️  Skipped {duplicate_chunks} duplicate chunks")
+        
+        if existing_chunks and added_chunks <= INCREMENTAL_INGEST_MAX_RATIO * existing_chunks:
+            vectorizer, vectors, vector_scales, row_norms_inv = self.vectorizer, self.vectors, self.vector_scales, self.row_norms_inv
+            if added_chunks:
+                print(f"➕ Appending {added_chunks} chunks to the existing index")
+                vectors, vector_scales, row_norms_inv = self.append_vectors(
+                    vectorizer, vectors, vector_scales, row_norms_inv,
+                    [m['text'] for m in metadata[existing_chunks:]]
+                )
+            self.publish_index(vectorizer, vectors, vector_scales, row_norms_inv, metadata, manifest)
+            self.save_index()
+        elif metadata:
+            vectorizer = build_vectorizer()
+            vectors = vectorizer.fit_transform([m['text'] for m in metadata])
+            vector_scales = None
+            if VECTOR_QUANTIZATION == "int8":
+                vectors, vector_scales = quantize_int8(vectors)
+            vectors = vectors.tocsc()
+            self.publish_index(vectorizer, vectors, vector_scales, inverse_row_norms(vectors), metadata, manifest)
+            print(f"✅ Indexed {np.count_nonzero(np.diff(vectors.indptr))} hashed terms")
             self.save_index()
+        else:
+            self._reset_index()
         
         return {
             "status": "success",
             "message": f"Ingested {len(pdf_files)} PDF(s)",
-            "count": total_chunks
+            "count": len(metadata),
+            "added": added_chunks
         }
 
+    def append_vectors(self, vectorizer, vectors, vector_scales, row_norms_inv, texts: List[str]):
+        new_vectors = vectorizer.transform(texts)
+        if vector_scales is not None:
+            new_vectors, scales = quantize_int8(new_vectors)
+            vector_scales = np.concatenate([vector_scales, scales])
+        vectors = sparse.vstack([vectors.tocsr(), new_vectors], format='csr').tocsc()
+        return vectors, vector_scales, np.concatenate([row_norms_inv, inverse_row_norms(new_vectors)])
+
     def retrieve_context(self, query: str, top_k: int = 3) -> List[str]:
-        if self.vectors is None or len(self.metadata) == 0:
+        return self.retrieve_context_batch([query], top_k)[0]
+
+    def retrieve_context_batch(self, queries: List[str], top_k: int = 3) -> List[List[str]]:
+        vectorizer, vectors, row_norms_inv, metadata = self.index_snapshot()
+        if vectors is None or len(metadata) == 0:
             print("⚠️  Index is empty")
-            return []
+            return [[] for _ in queries]
         
-        sources = set(m['source'] for m in self.metadata)
+        sources = self.source_set
         print(f"📚 Index contains {len(sources)} documents: {list(sources)}")
         
+        try:
+            query_vectors = self.embed_queries(queries, vectorizer)
+            similarities = (query_vectors @ vectors.T).toarray() * row_norms_inv
+        except Exception as e:
+            print(f"Error retrieving context: {e}")
+            return [[] for _ in queries]
+        
+        return [
+            self._rank_context(query, query_vectors[i], similarities[i], top_k, vectors, metadata)
+            for i, query in enumerate(queries)
+        ]
+
+    def _rank_context(self, query: str, query_vector, similarities: np.ndarray, top_k: int, vectors, metadata: List[Dict]) -> List[str]:
         try:
             print(f"🔍 Processing Query: '{query}'")
             
-            terms = query.lower().split()
-            known_terms = [t for t in terms if t in self.vectorizer.vocabulary_]
-            print(f"   Vocabulary matches: {known_terms} (out of {terms})")
+            indexed_terms = np.count_nonzero(np.diff(vectors.indptr)[query_vector.indices])
+            print(f"   Indexed term matches: {indexed_terms} (out of {query_vector.nnz})")
             
-            query_vector = self.vectorizer.transform([query])
-            
-            if query_vector.nnz == 0:
-                print(f"⚠️  Query has NO matching terms in the vocabulary!")
+            if indexed_terms == 0:
+                print(f"⚠️  Query has NO matching terms in the index!")
                 return []
             
-            similarities = cosine_similarity(query_vector, self.vectors).flatten()
-            
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
+            k = min(top_k, len(similarities))
+            candidates = np.argpartition(similarities, -k)[-k:]
+            top_indices = candidates[np.argsort(similarities[candidates])[::-1]]
             
             results = []
             for idx in top_indices:
                 score = similarities[idx]
                 if score > 0:
-                    meta = self.metadata[idx]
+                    meta = metadata[idx]
                     print(f"   📄 Match: {meta['source']} (Score: {score:.4f})")
                     results.append(meta["text"])
             
@@ -160,78 +497,237 @@ class RAGEngine:
             print(f"Error retrieving context: {e}")
             return []
 
-    def generate_response(self, query: str, context: List[str]) -> str:
-        if not self.gemini_api_key:
-            return "Error: GEMINI_API_KEY not configured"
+    def _gemini_request(self, query: str, context: List[str]):
+        context_text = "\n\n".join(sorted(context))
         
-        if not context:
-            return "I couldn't find relevant information in the knowledge base. Please make sure PDFs are ingested."
+        prompt = PROMPT_PREFIX + context_text + PROMPT_MIDDLE + query + PROMPT_SUFFIX
         
-        context_text = "\n\n".join(context)
+        payload = {
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }],
+            "generationConfig": {
+                "temperature": 0.3,
+                "maxOutputTokens": 500
+            }
+        }
         
-        system_prompt = """You are a helpful AI assistant that answers questions based ONLY on the provided knowledge base.
+        body = orjson.dumps(payload)
+        headers = {"Content-Type": "application/json"}
+        if GEMINI_GZIP_MIN_BYTES and len(body) > GEMINI_GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
 
-CRITICAL RULES:
-1. ONLY use information from the knowledge base provided below
-2. If the answer is not in the knowledge base, say: "I don't have this information in the knowledge base provided."
-3. Be concise and direct - this is for WhatsApp messaging
-4. Keep responses under 500 characters when possible
-5. Use simple language, avoid jargon
-6. Do NOT make up information or use external knowledge
-7. Always refer to the source as "knowledge base" not "document"
-
-KNOWLEDGE BASE:
-{context}
-
-USER QUESTION: {query}
+    def _gemini_answer(self, response) -> Tuple[str, bool]:
+        if response.status_code == 200:
+            result = orjson.loads(response.content)
+            if 'candidates' in result and len(result['candidates']) > 0:
+                answer = result['candidates'][0]['content']['parts'][0]['text']
+                return answer.strip(), True
+            else:
+                return "I couldn't generate a response. Please try rephrasing your question.", False
+        else:
+            print(f"Gemini API error: {response.status_code} - {response.text}")
+            return f"Error generating response. Please try again.", False
 
-YOUR ANSWER (concise, knowledge base only):"""
+    def _generation_precheck(self, context: List[str]) -> Optional[str]:
+        if not self.gemini_api_key:
+            return "Error: GEMINI_API_KEY not configured"
         
-        prompt = system_prompt.format(context=context_text, query=query)
+        if not context:
+            return "I couldn't find relevant information in the knowledge base. Please make sure PDFs are ingested."
+        return None
+
+    def generate_answer(self, query: str, context: List[str]) -> Tuple[str, bool]:
+        error = self._generation_precheck(context)
+        if error:
+            return error, False
         
         try:
-            payload = {
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }],
-                "generationConfig": {
-                    "temperature": 0.3,
-                    "maxOutputTokens": 500
-                }
-            }
-            
-            response = requests.post(
+            body, headers = self._gemini_request(query, context)
+            response = self.session.post(
                 self.gemini_url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
+                data=body,
+                headers=headers,
                 timeout=30
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'candidates' in result and len(result['candidates']) > 0:
-                    answer = result['candidates'][0]['content']['parts'][0]['text']
-                    return answer.strip()
-                else:
-                    return "I couldn't generate a response. Please try rephrasing your question."
-            else:
-                print(f"Gemini API error: {response.status_code} - {response.text}")
-                return f"Error generating response. Please try again."
+            return self._gemini_answer(response)
                 
         except requests.exceptions.Timeout:
-            return "Request timed out. Please try again."
+            return "Request timed out. Please try again.", False
         except Exception as e:
             print(f"Error calling Gemini API: {e}")
-            return "An error occurred while generating the response."
+            return "An error occurred while generating the response.", False
 
-    def query(self, query: str) -> Dict:
-        context = self.retrieve_context(query)
-        answer = self.generate_response(query, context)
+    def get_async_client(self) -> httpx.AsyncClient:
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(
+                http2=GEMINI_HTTP2,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=30
+            )
+        return self.async_client
+
+    async def warmup(self):
+        try:
+            await self.get_async_client().head(GEMINI_ORIGIN)
+            await asyncio.to_thread(self.session.head, GEMINI_ORIGIN, timeout=10)
+        except Exception as e:
+            print(f"⚠️  Gemini connection warmup failed: {e}")
+
+    async def aclose(self):
+        if self._query_batcher is not None:
+            self._query_batcher.cancel()
+            self._query_batcher = None
+            self._query_queue = None
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+
+    async def generate_answer_async(self, query: str, context: List[str]) -> Tuple[str, bool]:
+        error = self._generation_precheck(context)
+        if error:
+            return error, False
+        
+        try:
+            body, headers = self._gemini_request(query, context)
+            response = await self.get_async_client().post(self.gemini_url, content=body, headers=headers)
+            return self._gemini_answer(response)
+                
+        except httpx.TimeoutException:
+            return "Request timed out. Please try again.", False
+        except Exception as e:
+            print(f"Error calling Gemini API: {e}")
+            return "An error occurred while generating the response.", False
+
+    def embed_queries(self, queries: List[str], vectorizer=None):
+        if vectorizer is None:
+            vectorizer = self.index_snapshot()[0]
+        keys = [hashlib.blake2b(q.encode(), digest_size=16).digest() for q in queries]
+        rows = [None] * len(queries)
+        with self._query_vector_lock:
+            for i, key in enumerate(keys):
+                row = self.query_vector_cache.get(key)
+                if row is not None:
+                    self.query_vector_cache.move_to_end(key)
+                    rows[i] = row
+        
+        misses = [i for i, row in enumerate(rows) if row is None]
+        if misses:
+            computed = vectorizer.transform([queries[i] for i in misses])
+            with self._query_vector_lock:
+                current = self.vectorizer is vectorizer
+                for j, i in enumerate(misses):
+                    rows[i] = computed[j]
+                    if current:
+                        self.query_vector_cache[keys[i]] = rows[i]
+                while len(self.query_vector_cache) > self.query_vector_cache_size:
+                    self.query_vector_cache.popitem(last=False)
         
+        return sparse.vstack(rows, format='csr')
+
+    def cache_vectors(self, texts: List[str]):
+        return CACHE_VECTORIZER.transform(texts)
+
+    def _cached_result(self, query: str, cache_vector):
+        if cache_vector.nnz > 0:
+            cached = self.query_cache.get(cache_vector)
+            if cached is not None:
+                print(f"⚡ Semantic cache hit for: '{query}'")
+                return cached
+        return None
+
+    def _build_result(self, cache_vector, context: List[str], answer: str, generated: bool) -> Dict:
         sources = list(set([m['source'] for m in self.metadata if m['text'] in context]))
         
-        return {
+        result = {
             "answer": answer,
             "context": context,
-            "sources": sources
+            "sources": sources,
+            "generated": generated
         }
+        
+        if context and generated and cache_vector.nnz > 0:
+            self.query_cache.put(cache_vector, result)
+        
+        return result
+
+    def query(self, query: str) -> Dict:
+        cache_vector = self.cache_vectors([query])
+        cached = self._cached_result(query, cache_vector)
+        if cached is not None:
+            return cached
+        
+        context = self.retrieve_context(query)
+        answer, generated = self.generate_answer(query, context)
+        
+        return self._build_result(cache_vector, context, answer, generated)
+
+    def _prepare_batch(self, queries: List[str]):
+        results = [None] * len(queries)
+        misses = []
+        cache_vectors = self.cache_vectors(queries)
+        
+        for i, query in enumerate(queries):
+            results[i] = self._cached_result(query, cache_vectors[i])
+            if results[i] is None:
+                misses.append(i)
+        
+        contexts = self.retrieve_context_batch([queries[i] for i in misses]) if misses else []
+        return results, misses, cache_vectors, contexts
+
+    def _finish_batch(self, results: List[Dict], misses: List[int], cache_vectors, contexts: List[List[str]], answers: List[Tuple[str, bool]]) -> List[Dict]:
+        for i, context, (answer, generated) in zip(misses, contexts, answers):
+            results[i] = self._build_result(cache_vectors[i], context, answer, generated)
+        return results
+
+    async def query_batch_async(self, queries: List[str]) -> List[Dict]:
+        results, misses, cache_vectors, contexts = await asyncio.to_thread(self._prepare_batch, queries)
+        if not misses:
+            return results
+        
+        answers = await asyncio.gather(*(
+            self.generate_answer_async(queries[i], context) for i, context in zip(misses, contexts)
+        ))
+        
+        return await asyncio.to_thread(self._finish_batch, results, misses, cache_vectors, contexts, answers)
+
+    async def _batch_queries(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + QUERY_BATCH_MAX_WAIT
+            while len(batch) < QUERY_BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            task = asyncio.create_task(self._run_query_batch(batch))
+            self._pending_batches.add(task)
+            task.add_done_callback(self._pending_batches.discard)
+
+    async def _run_query_batch(self, batch: list):
+        try:
+            results = await self.query_batch_async([q for q, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def query_async(self, query: str) -> Dict:
+        if self._query_queue is None:
+            self._query_queue = asyncio.Queue()
+            self._query_batcher = asyncio.create_task(self._batch_queries(self._query_queue))
+        future = asyncio.get_running_loop().create_future()
+        await self._query_queue.put((query, future))
+        return await future
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from typing import Any, List, Optional
+import threading
+import time
+import numpy as np
+from scipy import sparse
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.95, maxsize: int = 4096, ttl: float = 3600,
+                 num_tables: int = 8, num_bits: int = 16, seed: int = 0):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self._entries = OrderedDict()
+        self._buckets = [{} for _ in range(num_tables)]
+        self._planes = {}
+        self._bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _plane_rows(self, indices) -> np.ndarray:
+        rows = []
+        for index in indices.tolist():
+            row = self._planes.get(index)
+            if row is None:
+                rng = np.random.default_rng((self.seed, index))
+                row = self._planes[index] = rng.standard_normal(self.num_tables * self.num_bits).astype(np.float32)
+            rows.append(row)
+        return np.array(rows, dtype=np.float32).reshape(-1, self.num_tables * self.num_bits)
+
+    def _signatures(self, vector) -> List[int]:
+        vector = vector.tocsr()
+        projections = vector.data.astype(np.float32) @ self._plane_rows(vector.indices)
+        bits = (projections > 0).reshape(self.num_tables, self.num_bits)
+        return (bits @ self._bit_weights).tolist()
+
+    def _remove(self, entry_id: int):
+        _, _, _, signatures = self._entries.pop(entry_id)
+        for table, signature in zip(self._buckets, signatures):
+            bucket = table.get(signature)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[signature]
+
+    def get(self, vector) -> Optional[Any]:
+        with self._lock:
+            if not self._entries:
+                return None
+            candidates = set()
+            for table, signature in zip(self._buckets, self._signatures(vector)):
+                candidates.update(table.get(signature, ()))
+
+            now = time.monotonic()
+            best_id, best_score = None, self.threshold
+            for entry_id in candidates:
+                cached_vector, _, expires_at, _ = self._entries[entry_id]
+                if expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                score = cached_vector.multiply(vector).sum()
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][1]
+
+    def put(self, vector, value: Any):
+        with self._lock:
+            vector = sparse.csr_matrix(vector)
+            signatures = self._signatures(vector)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (vector, value, time.monotonic() + self.ttl, signatures)
+            for table, signature in zip(self._buckets, signatures):
+                table.setdefault(signature, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets = [{} for _ in range(self.num_tables)]
+            self._planes.clear()
@@ -1,15 +1,26 @@
 from twilio.twiml.voice_response import VoiceResponse, Gather, Say
+from xml.sax.saxutils import escape
+import re
 from rag_engine import RAGEngine
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ANSWER_PLACEHOLDER = "__ANSWER__"
+
 class TwilioIVRHandler:
+    _YES_RE = re.compile(r"\b(?:yes|yeah|sure|yep|ok|okay)\b", re.I)
+    
     def __init__(self, rag_engine: RAGEngine):
         self.rag_engine = rag_engine
+        self._tw_welcome = self._build_welcome()
+        self._tw_retry = self._build_retry()
+        self._tw_answer = self._build_answer()
+        self._tw_error = self._build_error()
+        self._tw_continue = self._build_continue()
+        self._tw_goodbye = self._build_goodbye()
     
-    def handle_incoming_call(self) -> str:
+    def _build_welcome(self) -> str:
         response = VoiceResponse()
         
         response.say(
@@ -38,78 +49,96 @@ class TwilioIVRHandler:
         
         return str(response)
     
-    def handle_speech_input(self, speech_result: str) -> str:
-        logger.info(f"Received speech: {speech_result}")
+    def _build_retry(self) -> str:
+        response = VoiceResponse()
+        response.say(
+            "I didn't catch that. Please try again.",
+            voice='Polly.Joanna'
+        )
+        response.redirect('/voice/incoming')
+        return str(response)
+    
+    def _build_answer(self) -> str:
+        response = VoiceResponse()
+        response.say(ANSWER_PLACEHOLDER, voice='Polly.Joanna')
         
+        gather = Gather(
+            input='speech',
+            action='/voice/continue',
+            speech_timeout='auto',
+            language='en-US',
+            num_digits=1,
+            timeout=3
+        )
+        gather.say(
+            "Would you like to ask another question? Say yes or no.",
+            voice='Polly.Joanna'
+        )
+        response.append(gather)
+        
+        response.say("Thank you for calling. Goodbye!", voice='Polly.Joanna')
+        response.hangup()
+        return str(response)
+    
+    def _build_error(self) -> str:
+        response = VoiceResponse()
+        response.say(
+            "I'm sorry, I encountered an error processing your request. Please try again later.",
+            voice='Polly.Joanna'
+        )
+        response.hangup()
+        return str(response)
+    
+    def _build_continue(self) -> str:
         response = VoiceResponse()
+        gather = Gather(
+            input='speech',
+            action='/voice/gather',
+            speech_timeout='auto',
+            language='en-US'
+        )
+        gather.say(
+            "Great! What would you like to know?",
+            voice='Polly.Joanna'
+        )
+        response.append(gather)
+        
+        response.say("I didn't hear anything. Goodbye!", voice='Polly.Joanna')
+        response.hangup()
+        return str(response)
+    
+    def _build_goodbye(self) -> str:
+        response = VoiceResponse()
+        response.say(
+            "Thank you for calling. Have a great day!",
+            voice='Polly.Joanna'
+        )
+        response.hangup()
+        return str(response)
+    
+    def handle_incoming_call(self) -> str:
+        return self._tw_welcome
+    
+    def handle_speech_input(self, speech_result: str) -> str:
+        logger.info("Received speech: %s", speech_result)
         
         if not speech_result:
-            response.say(
-                "I didn't catch that. Please try again.",
-                voice='Polly.Joanna'
-            )
-            response.redirect('/voice/incoming')
-            return str(response)
+            return self._tw_retry
         
         try:
             result = self.rag_engine.query(speech_result)
             answer = result['answer']
-            logger.info(f"RAG response: {answer}")
-            
-            response.say(answer, voice='Polly.Joanna')
-            
-            gather = Gather(
-                input='speech',
-                action='/voice/continue',
-                speech_timeout='auto',
-                language='en-US',
-                num_digits=1,
-                timeout=3
-            )
-            gather.say(
-                "Would you like to ask another question? Say yes or no.",
-                voice='Polly.Joanna'
-            )
-            response.append(gather)
-            
-            response.say("Thank you for calling. Goodbye!", voice='Polly.Joanna')
-            response.hangup()
+            logger.info("RAG response: %s", answer)
             
-        except Exception as e:
-            logger.error(f"Error processing query: {e}")
-            response.say(
-                "I'm sorry, I encountered an error processing your request. Please try again later.",
-                voice='Polly.Joanna'
-            )
-            response.hangup()
+            return self._tw_answer.replace(ANSWER_PLACEHOLDER, escape(answer), 1)
         
-        return str(response)
+        except Exception as e:
+            logger.error("Error processing query: %s", e)
+            return self._tw_error
     
     def handle_continue(self, speech_result: str) -> str:
-        logger.info(f"Continue response: {speech_result}")
-        
-        response = VoiceResponse()
-        
-        if speech_result and any(word in speech_result.lower() for word in ['yes', 'yeah', 'sure', 'yep']):
-            gather = Gather(
-                input='speech',
-                action='/voice/gather',
-                speech_timeout='auto',
-                language='en-US'
-            )
-            gather.say(
-                "Great! What would you like to know?",
-                voice='Polly.Joanna'
-            )
-            response.append(gather)
-            
-            response.say("I didn't hear anything. Goodbye!", voice='Polly.Joanna')
-            response.hangup()
-        else:
-            response.say(
-                "Thank you for calling. Have a great day!",
-                voice='Polly.Joanna'
-            )
-            response.hangup()
+        logger.info("Continue response: %s", speech_result)
         
-        return str(response)
+        if speech_result and self._YES_RE.search(speech_result):
+            return self._tw_continue
+        return self._tw_goodbye
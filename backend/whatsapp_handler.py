@@ -1,286 +1,746 @@
 import os
+import io
+import re
+import base64
+import time
+import hashlib
+import sqlite3
+import asyncio
+import select
+import subprocess
+import tempfile
+import threading
+import multiprocessing
+import wave
+import av
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from cachetools import LRUCache, TTLCache
 import assemblyai as aai
-from gtts import gTTS
-from typing import Dict
+import numpy as np
+from gtts import gTTS, gTTSError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional
 from rag_engine import RAGEngine
+from semantic_cache import SemanticCache
 import logging
-import tempfile
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WhatsAppHandler:
-    def __init__(self, rag_engine: RAGEngine):
-        self.rag_engine = rag_engine
-        aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+AUDIO_DIR = os.path.join(os.path.dirname(__file__), 'static', 'audio')
+TTS_LANG = 'en'
+TTS_CACHE_TTL = float(os.getenv("TTS_CACHE_TTL", "86400"))
+TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts").lower()
+PIPER_BINARY = os.getenv("PIPER_BINARY", "piper")
+PIPER_MODEL = os.getenv("PIPER_MODEL")
+PIPER_TIMEOUT = float(os.getenv("PIPER_TIMEOUT", "20"))
+ASR_CONCURRENCY = int(os.getenv("ASR_CONCURRENCY", "8"))
+RAG_CONCURRENCY = int(os.getenv("RAG_CONCURRENCY", "16"))
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+KEEPALIVE_INTERVAL = float(os.getenv("CONNECTION_KEEPALIVE_INTERVAL", "0"))
+TWILIO_API_ORIGIN = "https://api.twilio.com/"
+GTTS_ORIGIN = "https://translate.google.com/"
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", os.path.join(os.path.dirname(__file__), 'transcripts.db'))
+MEDIA_CACHE_BYTES = int(os.getenv("MEDIA_CACHE_BYTES", str(16 * 1024 * 1024)))
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 86400)))
+AUDIO_DECODE_PROCESSES = int(os.getenv("AUDIO_DECODE_PROCESSES", "0"))
+
+ENABLE_CHUNKED_ASR = os.getenv("ENABLE_CHUNKED_ASR", "false").lower() == "true"
+ASR_SAMPLE_RATE = 16000
+ASR_CHUNK_SECONDS = float(os.getenv("ASR_CHUNK_SECONDS", "20"))
+ASR_CHUNK_OVERLAP = 0.5
+ASR_CHUNK_SEARCH = 2.0
+if ASR_CHUNK_SECONDS <= 2 * (ASR_CHUNK_SEARCH + ASR_CHUNK_OVERLAP):
+    raise ValueError(f"ASR_CHUNK_SECONDS must be greater than {2 * (ASR_CHUNK_SEARCH + ASR_CHUNK_OVERLAP):g}")
+ASR_MAX_CONCURRENCY = int(os.getenv("ASR_MAX_CONCURRENCY", "4"))
+ASSEMBLYAI_REALTIME = os.getenv("ASSEMBLYAI_REALTIME", "false").lower() == "true"
+REALTIME_TIMEOUT = float(os.getenv("ASSEMBLYAI_REALTIME_TIMEOUT", "15"))
+REALTIME_FRAME_BYTES = ASR_SAMPLE_RATE * 2 // 5
+NEEDS_PCM = ENABLE_CHUNKED_ASR or ASSEMBLYAI_REALTIME
+VAD_ENABLED = os.getenv("ENABLE_VAD", "true").lower() == "true"
+VAD_RMS_THRESHOLD = float(os.getenv("VAD_RMS_THRESHOLD", "300"))
+VAD_FRAME_MS = 30
+VAD_MIN_SPEECH_MS = 300
+ASSEMBLYAI_SPEECH_MODEL = os.getenv("ASSEMBLYAI_SPEECH_MODEL")
+ASR_POLL_TIMEOUT = float(os.getenv("ASSEMBLYAI_POLL_TIMEOUT", "300"))
+ASR_ENGINE = os.getenv("ASR_ENGINE", "assemblyai").lower()
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base.en")
+
+def _pcm_to_wav(samples: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(ASR_SAMPLE_RATE)
+        out.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def pcm_to_float32(samples: np.ndarray) -> np.ndarray:
+    return np.multiply(samples, np.float32(1 / 32768), dtype=np.float32)
+
+def decode_to_wav(audio: bytes) -> bytes:
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=ASR_SAMPLE_RATE)
+    frames = []
+    with av.open(io.BytesIO(audio)) as container:
+        for frame in container.decode(audio=0):
+            frames.extend(out.to_ndarray().ravel() for out in resampler.resample(frame))
+    frames.extend(out.to_ndarray().ravel() for out in resampler.resample(None))
+    if not frames:
+        raise ValueError("no audio frames decoded")
+    return _pcm_to_wav(np.concatenate(frames))
+
+def encode_mp3(wav_path: str, mp3_path: str):
+    with av.open(wav_path) as source, av.open(mp3_path, 'w', format='mp3') as target:
+        input_stream = source.streams.audio[0]
+        stream = target.add_stream('libmp3lame', rate=input_stream.rate)
+        stream.layout = 'mono'
+        stream.format = 's16p'
+        stream.bit_rate = 64000
+        for frame in source.decode(input_stream):
+            frame.pts = None
+            for packet in stream.encode(frame):
+                target.mux(packet)
+        for packet in stream.encode(None):
+            target.mux(packet)
+
+def wav_samples(wav_audio: bytes) -> Optional[np.ndarray]:
+    data_at = wav_audio.find(b'data', 12) if wav_audio[:4] == b'RIFF' and wav_audio[8:12] == b'WAVE' else -1
+    if data_at < 0:
+        return None
+    pcm = wav_audio[data_at + 8:]
+    return np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2')
+
+def has_speech(samples: np.ndarray, threshold: float = VAD_RMS_THRESHOLD, min_speech_ms: int = VAD_MIN_SPEECH_MS) -> bool:
+    frame = ASR_SAMPLE_RATE * VAD_FRAME_MS // 1000
+    frames = samples[:len(samples) // frame * frame].astype(np.float32).reshape(-1, frame)
+    rms = np.sqrt((frames ** 2).mean(axis=1))
+    return int((rms > threshold).sum()) * VAD_FRAME_MS >= min_speech_ms
+
+def split_wav(wav_audio: bytes, chunk_seconds: float = ASR_CHUNK_SECONDS, overlap_seconds: float = ASR_CHUNK_OVERLAP) -> List[bytes]:
+    samples = wav_samples(wav_audio)
+    if samples is None:
+        return [wav_audio]
     
-    def download_audio(self, media_url: str, auth: tuple) -> str:
-        try:
-            response = requests.get(media_url, auth=auth)
-            response.raise_for_status()
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.ogg')
-            temp_file.write(response.content)
-            temp_file.close()
-            
-            return temp_file.name
-        except Exception as e:
-            logger.error(f"Error downloading audio: {e}")
-            raise
+    window = int(chunk_seconds * ASR_SAMPLE_RATE)
+    if len(samples) <= window:
+        return [wav_audio]
     
-    def convert_to_wav(self, ogg_file: str) -> str:
-        try:
-            import subprocess
-            
-            wav_file = ogg_file.replace('.ogg', '.wav')
-            
-            subprocess.run([
-                'ffmpeg', '-i', ogg_file,
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                wav_file
-            ], check=True, capture_output=True)
-            
-            return wav_file
-        except Exception as e:
-            logger.error(f"Error converting audio: {e}")
-            return ogg_file
+    overlap = int(overlap_seconds * ASR_SAMPLE_RATE)
+    frame = ASR_SAMPLE_RATE // 50
+    if window <= overlap + frame:
+        raise ValueError("chunk_seconds must be longer than the chunk overlap")
+    search = int(ASR_CHUNK_SEARCH * ASR_SAMPLE_RATE)
+    chunks = []
+    start = 0
+    while True:
+        end = start + window
+        if end >= len(samples):
+            chunks.append(_pcm_to_wav(samples[start:]))
+            return chunks
+        lo = min(max(end - search, start + overlap + frame), end)
+        region = samples[lo:lo + ((end - lo) // frame) * frame].astype(np.int32)
+        if len(region):
+            energy = np.abs(region.reshape(-1, frame)).sum(axis=1)
+            end = lo + int(np.argmin(energy)) * frame + frame // 2
+        chunks.append(_pcm_to_wav(samples[start:end]))
+        assert end - overlap > start
+        start = end - overlap
+
+def merge_transcripts(parts: List[str], max_overlap: int = 8) -> str:
+    words = []
+    for part in parts:
+        following = part.split()
+        normalized = [w.lower().strip('.,!?') for w in following]
+        previous = [w.lower().strip('.,!?') for w in words[-max_overlap:]]
+        overlap = next((k for k in range(min(len(previous), len(normalized)), 0, -1)
+                        if previous[-k:] == normalized[:k]), 0)
+        words.extend(following[overlap:])
+    return " ".join(words)
+
+FAST_PATH_RE = re.compile(
+    r"^\s*(?:"
+    r"(?P<greeting>hi+|hello+|hey+|good\s+(?:morning|afternoon|evening))"
+    r"|(?P<thanks>thanks?(?:\s+(?:you|so\s+much|a\s+lot))?|thank\s+you(?:\s+(?:so\s+much|very\s+much))?|thx|ty)"
+    r"|(?P<bye>bye+|good\s*bye|see\s+you|good\s+night)"
+    r"|(?P<yes>yes|yeah|yep|sure|ok(?:ay)?)"
+    r"|(?P<no>no|nope|nah)"
+    r")[\s!.]*$",
+    re.I
+)
+
+CANNED_REPLIES = {
+    "greeting": "Hello! 👋 I'm your AI assistant. Ask me anything about the knowledge base!",
+    "thanks": "You're welcome! Ask me anything else about the knowledge base.",
+    "bye": "Goodbye! 👋 Message me anytime you have a question.",
+    "yes": "Great! What would you like to know?",
+    "no": "No problem. I'm here whenever you have a question."
+}
+
+class PooledGTTS(gTTS):
+    SESSION = requests.Session()
+    SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+    AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
     
-    def transcribe_audio(self, audio_file: str) -> str:
+    def _fetch_part(self, prepared) -> bytes:
         try:
-            if not os.getenv("ASSEMBLYAI_API_KEY"):
-                logger.error("ASSEMBLYAI_API_KEY not set")
-                return ""
-            
-            logger.info("Transcribing with AssemblyAI...")
-            transcriber = aai.Transcriber()
-            transcript = transcriber.transcribe(audio_file)
-            
-            if transcript.status == aai.TranscriptStatus.error:
-                logger.error(f"Transcription error: {transcript.error}")
-                return ""
-            
-            logger.info(f"Transcribed: {transcript.text}")
-            return transcript.text
-        except Exception as e:
-            logger.error(f"Transcription error: {e}")
-            return ""
+            response = self.SESSION.send(prepared, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            raise gTTSError(tts=self)
+        if not response.ok:
+            raise gTTSError(tts=self, response=response)
+        match = self.AUDIO_RE.search(response.text)
+        if not match:
+            raise gTTSError(tts=self, response=response)
+        return base64.b64decode(match.group(1))
     
-    def generate_audio_response(self, text: str) -> str:
-        try:
-            import hashlib
-            import time
-            
-            static_dir = os.path.join(os.path.dirname(__file__), 'static', 'audio')
-            os.makedirs(static_dir, exist_ok=True)
-            
-            timestamp = str(int(time.time()))
-            text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-            filename = f"response_{timestamp}_{text_hash}.mp3"
-            audio_path = os.path.join(static_dir, filename)
-            
-            tts = gTTS(text=text, lang='en', slow=False)
-            tts.save(audio_path)
-            
-            logger.info(f"Generated audio response: {filename}")
-            return filename
-        except Exception as e:
-            logger.error(f"Error generating audio: {e}")
-            return None
+    def stream(self):
+        prepared = self._prepare_requests()
+        if len(prepared) == 1:
+            yield self._fetch_part(prepared[0])
+            return
+        with ThreadPoolExecutor(max_workers=min(8, len(prepared))) as executor:
+            yield from executor.map(self._fetch_part, prepared)
+
+class PiperTTS:
+    def __init__(self, model: str, binary: str = PIPER_BINARY, timeout: float = PIPER_TIMEOUT):
+        self.model = model
+        self.binary = binary
+        self.timeout = timeout
+        self.output_dir = tempfile.mkdtemp(prefix='piper_')
+        self._proc = None
+        self._lock = threading.Lock()
     
-    def process_voice_message(self, media_url: str, auth: tuple) -> Dict[str, str]:
-        audio_file = None
-        wav_file = None
-        
+    def _ensure_process(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                [self.binary, '--model', self.model, '--output_dir', self.output_dir],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                bufsize=1
+            )
+        return self._proc
+    
+    def _read_line(self, proc: subprocess.Popen) -> Optional[str]:
+        fd = proc.stdout.fileno()
+        deadline = time.monotonic() + self.timeout
+        line = b""
+        while not line.endswith(b"\n"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            line += chunk
+        return line.decode().strip()
+    
+    def synthesize(self, text: str, mp3_path: str):
+        with self._lock:
+            proc = self._ensure_process()
+            proc.stdin.write(" ".join(text.split()) + "\n")
+            proc.stdin.flush()
+            wav_path = self._read_line(proc)
+            if wav_path is None:
+                proc.kill()
+                proc.wait()
+                self._proc = None
+                raise RuntimeError(f"piper did not respond within {self.timeout:g}s")
+        if not wav_path:
+            raise RuntimeError("piper exited without producing audio")
         try:
-            logger.info("Downloading voice message...")
-            audio_file = self.download_audio(media_url, auth)
-            
-            logger.info("Converting audio to WAV...")
-            wav_file = self.convert_to_wav(audio_file)
-            
-            logger.info("Transcribing with AssemblyAI...")
-            transcription = self.transcribe_audio(wav_file)
-            
-            if not transcription:
-                return {
-                    "text": "Sorry, I couldn't understand the audio. Please try again or send a text message.",
-                    "transcription": "",
-                    "audio_file": None
-                }
-            
-            logger.info(f"Querying RAG: {transcription}")
-            result = self.rag_engine.query(transcription)
-            
-            logger.info("Generating audio response...")
-            audio_response = self.generate_audio_response(result['answer'])
-            
-            return {
-                "text": result['answer'],
-                "transcription": transcription,
-                "audio_file": audio_response
-            }
-            
-        except Exception as e:
-            logger.error(f"Error processing voice: {e}")
-            return {
-                "text": "Sorry, I encountered an error processing your voice message. Please try sending a text message.",
-                "transcription": "",
-                "audio_file": None
-            }
+            encode_mp3(wav_path, mp3_path)
         finally:
-            if audio_file and os.path.exists(audio_file):
-                os.unlink(audio_file)
-import os
-import requests
-import assemblyai as aai
-from gtts import gTTS
-from typing import Dict
-from rag_engine import RAGEngine
-import logging
-import tempfile
+            os.unlink(wav_path)
+    
+    def close(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.stdin.close()
+            self._proc.terminate()
+        self._proc = None
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+class WhisperASR:
+    def __init__(self, model: str = WHISPER_MODEL):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model, device="cpu", compute_type="int8")
+        self._lock = threading.Lock()
+    
+    def transcribe(self, audio: bytes) -> str:
+        samples = wav_samples(audio)
+        if samples is None:
+            samples = wav_samples(decode_to_wav(audio))
+        with self._lock:
+            segments, _ = self.model.transcribe(pcm_to_float32(samples), beam_size=1, vad_filter=True)
+            return " ".join(segment.text.strip() for segment in segments).strip()
+
+class TranscriptCache:
+    def __init__(self, path: str = TRANSCRIPT_CACHE_PATH, ttl: float = TRANSCRIPT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS asr (key TEXT PRIMARY KEY, text TEXT NOT NULL, ts INTEGER NOT NULL)")
+    
+    @staticmethod
+    def key(audio: bytes) -> str:
+        return hashlib.sha1(audio).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM asr WHERE key = ? AND ts >= ?", (key, int(time.time() - self.ttl))
+            ).fetchone()
+        return row[0] if row else None
+    
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO asr (key, text, ts) VALUES (?, ?, ?)", (key, text, int(time.time()))
+            )
+    
+    def prune(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM asr WHERE ts < ?", (int(time.time() - self.ttl),)).rowcount
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    follow_redirects=True,
+    headers={"Accept-Encoding": "identity"},
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=16)
+)
 
 class WhatsAppHandler:
+    VOICE_ERROR_RESULT = {
+        "text": "Sorry, I encountered an error processing your voice message. Please try sending a text message.",
+        "transcription": "",
+        "audio_file": None
+    }
+    VOICE_UNCLEAR_RESULT = {
+        "text": "Sorry, I couldn't understand the audio. Please try again or send a text message.",
+        "transcription": "",
+        "audio_file": None
+    }
+    
     def __init__(self, rag_engine: RAGEngine):
         self.rag_engine = rag_engine
-        aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+        cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+        cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.response_cache = SemanticCache(
+            threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95")),
+            maxsize=cache_size,
+            ttl=cache_ttl
+        )
+        self._exact_responses = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._exact_lock = threading.Lock()
+        self._tts_locks = [threading.Lock() for _ in range(64)]
+        self._asr_sem = asyncio.Semaphore(ASR_CONCURRENCY)
+        self._rag_sem = asyncio.Semaphore(RAG_CONCURRENCY)
+        self._tts_sem = asyncio.Semaphore(TTS_CONCURRENCY)
+        self.piper = PiperTTS(PIPER_MODEL) if TTS_ENGINE == "piper" and PIPER_MODEL else None
+        self.whisper = WhisperASR() if ASR_ENGINE == "whisper" else None
+        self.transcripts = TranscriptCache()
+        self._media_cache = LRUCache(maxsize=MEDIA_CACHE_BYTES, getsizeof=len)
+        self._media_lock = threading.Lock()
+        self._decode_pool = ProcessPoolExecutor(max_workers=AUDIO_DECODE_PROCESSES, mp_context=multiprocessing.get_context("forkserver")) if AUDIO_DECODE_PROCESSES > 0 else None
+        self._has_asr_key = bool(aai.settings.api_key)
+        if not self._has_asr_key and self.whisper is None:
+            logger.warning("ASSEMBLYAI_API_KEY not set, voice messages cannot be transcribed")
+    
+    @staticmethod
+    def response_key(text: str) -> bytes:
+        return hashlib.blake2b(" ".join(text.lower().split()).encode(), digest_size=16).digest()
+    
+    def lookup_response(self, text: str):
+        with self._exact_lock:
+            cached = self._exact_responses.get(self.response_key(text))
+        if cached is not None and cached[0] is self.rag_engine.manifest:
+            return None, cached[1:]
+        
+        vector = self.rag_engine.cache_vectors([text])
+        if vector.nnz == 0:
+            return None, None
+        cached = self.response_cache.get(vector)
+        if cached is not None:
+            manifest, answer, audio_file = cached
+            if manifest is self.rag_engine.manifest:
+                return vector, (answer, audio_file)
+        return vector, None
+    
+    def store_response(self, text: str, vector, result: Dict, audio_file: Optional[str] = None):
+        if not (result['context'] and result.get('generated')):
+            return
+        entry = (self.rag_engine.manifest, result['answer'], audio_file)
+        with self._exact_lock:
+            self._exact_responses[self.response_key(text)] = entry
+        if vector is not None:
+            self.response_cache.put(vector, entry)
+    
+    def cached_voice_response(self, transcription: str):
+        vector, hit = self.lookup_response(transcription)
+        if hit and hit[1] and os.path.exists(os.path.join(AUDIO_DIR, hit[1])):
+            logger.info("Response cache hit for: %s", transcription)
+            return vector, {
+                "text": hit[0],
+                "transcription": transcription,
+                "audio_file": hit[1]
+            }
+        return vector, None
     
-    def download_audio(self, media_url: str, auth: tuple) -> str:
+    def cached_media(self, media_url: str) -> Optional[bytes]:
+        with self._media_lock:
+            audio = self._media_cache.get(media_url)
+        if audio is not None:
+            logger.info("Media cache hit for: %s", media_url)
+        return audio
+    
+    def store_media(self, media_url: str, audio: bytes):
+        if len(audio) > MEDIA_CACHE_BYTES:
+            return
+        with self._media_lock:
+            self._media_cache[media_url] = audio
+    
+    async def download_audio_async(self, media_url: str, auth: tuple) -> bytes:
+        audio = self.cached_media(media_url)
+        if audio is None:
+            raw = io.BytesIO()
+            try:
+                async with http_client.stream("GET", media_url, auth=auth) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(65536):
+                        raw.write(chunk)
+            except Exception as e:
+                logger.error("Error downloading audio: %s", e)
+                raise
+            audio = raw.getvalue()
+            self.store_media(media_url, audio)
+        return audio
+    
+    def convert_to_wav(self, audio: bytes) -> bytes:
         try:
-            response = requests.get(media_url, auth=auth)
-            response.raise_for_status()
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.ogg')
-            temp_file.write(response.content)
-            temp_file.close()
-            
-            return temp_file.name
+            if self._decode_pool is not None:
+                return self._decode_pool.submit(decode_to_wav, audio).result()
+            return decode_to_wav(audio)
         except Exception as e:
-            logger.error(f"Error downloading audio: {e}")
-            raise
+            logger.error("Error converting audio: %s", e)
+            return audio
     
-    def convert_to_wav(self, ogg_file: str) -> str:
+    def transcribe_realtime(self, samples: np.ndarray) -> str:
+        duration_ms = len(samples) * 1000 // ASR_SAMPLE_RATE
+        finals = []
+        errors = []
+        done = threading.Event()
+        
+        def on_data(transcript):
+            if isinstance(transcript, aai.RealtimeFinalTranscript):
+                if transcript.text:
+                    finals.append(transcript.text)
+                if transcript.audio_end >= duration_ms:
+                    done.set()
+        
+        def on_error(error):
+            errors.append(error)
+            done.set()
+        
+        transcriber = aai.RealtimeTranscriber(sample_rate=ASR_SAMPLE_RATE, on_data=on_data, on_error=on_error)
+        transcriber.connect()
         try:
-            import subprocess
-            
-            wav_file = ogg_file.replace('.ogg', '.wav')
-            
-            subprocess.run([
-                'ffmpeg', '-i', ogg_file,
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                wav_file
-            ], check=True, capture_output=True)
-            
-            return wav_file
-        except Exception as e:
-            logger.error(f"Error converting audio: {e}")
-            return ogg_file
+            pcm = samples.tobytes() + bytes(ASR_SAMPLE_RATE * 2)
+            for offset in range(0, len(pcm), REALTIME_FRAME_BYTES):
+                transcriber.stream(pcm[offset:offset + REALTIME_FRAME_BYTES])
+            done.wait(REALTIME_TIMEOUT)
+        finally:
+            transcriber.close(terminate=not errors)
+        
+        if errors:
+            raise RuntimeError(str(errors[0]))
+        return " ".join(finals)
     
-    def transcribe_audio(self, audio_file: str) -> str:
+    def transcribe_audio(self, audio: bytes) -> str:
+        if self.whisper is not None:
+            try:
+                logger.info("Transcribing with Whisper...")
+                text = self.whisper.transcribe(audio)
+                logger.info("Transcribed: %s", text)
+                return text
+            except Exception as e:
+                logger.error("Whisper transcription failed, falling back to AssemblyAI: %s", e)
+        
         try:
-            if not os.getenv("ASSEMBLYAI_API_KEY"):
+            if not self._has_asr_key:
                 logger.error("ASSEMBLYAI_API_KEY not set")
                 return ""
             
-            logger.info("Transcribing with AssemblyAI...")
-            transcriber = aai.Transcriber()
-            transcript = transcriber.transcribe(audio_file)
+            samples = wav_samples(audio) if ASSEMBLYAI_REALTIME else None
+            if samples is not None:
+                try:
+                    logger.info("Transcribing with AssemblyAI real-time...")
+                    text = self.transcribe_realtime(samples)
+                    if text:
+                        logger.info("Transcribed: %s", text)
+                        return text
+                except Exception as e:
+                    logger.error("Real-time transcription failed, falling back to batch: %s", e)
             
-            if transcript.status == aai.TranscriptStatus.error:
-                logger.error(f"Transcription error: {transcript.error}")
+            logger.info("Transcribing with AssemblyAI...")
+            transcript = self.transcribe_batch(audio)
+            
+            if transcript['status'] == 'error':
+                logger.error("Transcription error: %s", transcript.get('error'))
+                if wav_samples(audio) is None:
+                    wav_audio = self.convert_to_wav(audio)
+                    if wav_audio is not audio:
+                        logger.info("Retrying transcription with WAV audio...")
+                        return self.transcribe_audio(wav_audio)
                 return ""
             
-            logger.info(f"Transcribed: {transcript.text}")
-            return transcript.text
+            logger.info("Transcribed: %s", transcript['text'])
+            return transcript['text'] or ""
         except Exception as e:
-            logger.error(f"Transcription error: {e}")
+            logger.error("Transcription error: %s", e)
+            return ""
+    
+    def transcribe_batch(self, audio: bytes) -> Dict:
+        client = aai.Client.get_default().http_client
+        upload_url = aai.api.upload_file(client, io.BytesIO(audio))
+        request = {"audio_url": upload_url}
+        if ASSEMBLYAI_SPEECH_MODEL:
+            request["speech_model"] = ASSEMBLYAI_SPEECH_MODEL
+        response = client.post("/v2/transcript", json=request)
+        response.raise_for_status()
+        transcript = orjson.loads(response.content)
+        
+        started = time.monotonic()
+        while transcript['status'] not in ('completed', 'error'):
+            elapsed = time.monotonic() - started
+            if elapsed > ASR_POLL_TIMEOUT:
+                raise TimeoutError(f"transcript {transcript['id']} not ready after {ASR_POLL_TIMEOUT:.0f}s")
+            time.sleep(0.2 if elapsed < 2 else 0.5 if elapsed < 5 else 1.0)
+            response = client.get(f"/v2/transcript/{transcript['id']}")
+            response.raise_for_status()
+            transcript = orjson.loads(response.content)
+        return transcript
+    
+    async def transcribe_audio_async(self, audio: bytes) -> str:
+        chunks = split_wav(audio) if ENABLE_CHUNKED_ASR else [audio]
+        if len(chunks) == 1:
+            async with self._asr_sem:
+                return await asyncio.to_thread(self.transcribe_audio, audio)
+        
+        logger.info("Transcribing %d chunks concurrently...", len(chunks))
+        semaphore = asyncio.Semaphore(ASR_MAX_CONCURRENCY)
+        
+        async def transcribe_chunk(chunk: bytes) -> str:
+            async with semaphore, self._asr_sem:
+                return await asyncio.to_thread(self.transcribe_audio, chunk)
+        
+        parts = await asyncio.gather(*(transcribe_chunk(chunk) for chunk in chunks))
+        return merge_transcripts(parts)
+    
+    def prepare_audio(self, audio: bytes) -> Optional[bytes]:
+        needs_pcm = NEEDS_PCM or self.whisper is not None
+        if not (needs_pcm or VAD_ENABLED):
+            return audio
+        logger.info("Converting audio to WAV...")
+        wav_audio = self.convert_to_wav(audio)
+        samples = wav_samples(wav_audio)
+        if VAD_ENABLED and samples is not None and not has_speech(samples):
+            logger.info("No speech detected, skipping transcription")
+            return None
+        return wav_audio if needs_pcm else audio
+    
+    async def transcribe_media_async(self, audio: bytes) -> str:
+        key = self.transcripts.key(audio)
+        text = await asyncio.to_thread(self.transcripts.get, key)
+        if text is not None:
+            logger.info("Transcription cache hit")
+            return text
+        
+        audio = await asyncio.to_thread(self.prepare_audio, audio)
+        if audio is None:
             return ""
+        text = await self.transcribe_audio_async(audio)
+        if text:
+            await asyncio.to_thread(self.transcripts.put, key, text)
+        return text
+    
+    def audio_filename(self, text: str) -> str:
+        return f"response_{hashlib.sha1((text + TTS_LANG).encode()).hexdigest()}.mp3"
+    
+    async def generate_audio_response_async(self, text: str) -> Optional[str]:
+        if os.path.exists(os.path.join(AUDIO_DIR, self.audio_filename(text))):
+            return await asyncio.to_thread(self.generate_audio_response, text)
+        async with self._tts_sem:
+            return await asyncio.to_thread(self.generate_audio_response, text)
     
     def generate_audio_response(self, text: str) -> str:
         try:
-            import hashlib
-            import time
-            
-            static_dir = os.path.join(os.path.dirname(__file__), 'static', 'audio')
-            os.makedirs(static_dir, exist_ok=True)
-            
-            timestamp = str(int(time.time()))
-            text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-            filename = f"response_{timestamp}_{text_hash}.mp3"
-            audio_path = os.path.join(static_dir, filename)
-            
-            tts = gTTS(text=text, lang='en', slow=False)
-            tts.save(audio_path)
-            
-            logger.info(f"Generated audio response: {filename}")
+            os.makedirs(AUDIO_DIR, exist_ok=True)
+            
+            filename = self.audio_filename(text)
+            audio_path = os.path.join(AUDIO_DIR, filename)
+            
+            with self._tts_locks[hash(filename) % len(self._tts_locks)]:
+                if os.path.exists(audio_path):
+                    os.utime(audio_path)
+                    logger.info("Reusing audio response: %s", filename)
+                    return filename
+                
+                if self.piper is not None:
+                    try:
+                        self.piper.synthesize(text, audio_path + '.tmp')
+                    except Exception as e:
+                        logger.error("Piper TTS failed, falling back to gTTS: %s", e)
+                        PooledGTTS(text=text, lang=TTS_LANG, slow=False).save(audio_path + '.tmp')
+                else:
+                    tts = PooledGTTS(text=text, lang=TTS_LANG, slow=False)
+                    tts.save(audio_path + '.tmp')
+                os.replace(audio_path + '.tmp', audio_path)
+            
+            logger.info("Generated audio response: %s", filename)
             return filename
         except Exception as e:
-            logger.error(f"Error generating audio: {e}")
+            logger.error("Error generating audio: %s", e)
             return None
     
-    def process_voice_message(self, media_url: str, auth: tuple) -> Dict[str, str]:
-        audio_file = None
-        wav_file = None
-        
+    def prune_audio_files(self, max_age: float = TTS_CACHE_TTL) -> int:
+        if not os.path.isdir(AUDIO_DIR):
+            return 0
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(AUDIO_DIR):
+            try:
+                if entry.name.startswith('response_') and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+    
+    def voice_fallback(self, result: Dict) -> Dict[str, str]:
+        filename = self.audio_filename(result["text"])
+        return {**result, "audio_file": filename if os.path.exists(os.path.join(AUDIO_DIR, filename)) else None}
+    
+    async def prewarm_audio(self):
+        texts = [*CANNED_REPLIES.values(), self.VOICE_UNCLEAR_RESULT["text"], self.VOICE_ERROR_RESULT["text"]]
+        await asyncio.gather(*(self.generate_audio_response_async(text) for text in texts))
+    
+    async def audio_janitor(self, interval: float = 3600):
+        while True:
+            removed = await asyncio.to_thread(self.prune_audio_files)
+            if removed:
+                logger.info("Pruned %d expired audio responses", removed)
+            await self.prewarm_audio()
+            expired = await asyncio.to_thread(self.transcripts.prune)
+            if expired:
+                logger.info("Pruned %d expired transcriptions", expired)
+            await asyncio.sleep(interval)
+    
+    async def process_voice_message_async(self, media_url: str, auth: tuple) -> Dict[str, str]:
         try:
             logger.info("Downloading voice message...")
-            audio_file = self.download_audio(media_url, auth)
-            
-            logger.info("Converting audio to WAV...")
-            wav_file = self.convert_to_wav(audio_file)
-            
-            logger.info("Transcribing with AssemblyAI...")
-            transcription = self.transcribe_audio(wav_file)
+            audio = await self.download_audio_async(media_url, auth)
             
+            transcription = await self.transcribe_media_async(audio)
             if not transcription:
+                return self.voice_fallback(self.VOICE_UNCLEAR_RESULT)
+            
+            canned = self.canned_reply(transcription)
+            if canned:
                 return {
-                    "text": "Sorry, I couldn't understand the audio. Please try again or send a text message.",
-                    "transcription": "",
-                    "audio_file": None
+                    "text": canned,
+                    "transcription": transcription,
+                    "audio_file": await self.generate_audio_response_async(canned)
                 }
             
-            logger.info(f"Querying RAG: {transcription}")
-            result = self.rag_engine.query(transcription)
+            vector, cached = self.cached_voice_response(transcription)
+            if cached:
+                return cached
+            
+            logger.info("Querying RAG: %s", transcription)
+            async with self._rag_sem:
+                result = await self.rag_engine.query_async(transcription)
             
             logger.info("Generating audio response...")
-            audio_response = self.generate_audio_response(result['answer'])
+            audio_response = await self.generate_audio_response_async(result['answer'])
+            self.store_response(transcription, vector, result, audio_response)
             
             return {
                 "text": result['answer'],
                 "transcription": transcription,
                 "audio_file": audio_response
             }
-            
         except Exception as e:
-            logger.error(f"Error processing voice: {e}")
-            return {
-                "text": "Sorry, I encountered an error processing your voice message. Please try sending a text message.",
-                "transcription": "",
-                "audio_file": None
-            }
-        finally:
-            if audio_file and os.path.exists(audio_file):
-                os.unlink(audio_file)
-            if wav_file and wav_file != audio_file and os.path.exists(wav_file):
-                os.unlink(wav_file)
+            logger.error("Error processing voice: %s", e)
+            return self.voice_fallback(self.VOICE_ERROR_RESULT)
+    
+    def canned_reply(self, text: str) -> Optional[str]:
+        match = FAST_PATH_RE.match(text)
+        return CANNED_REPLIES[match.lastgroup] if match else None
     
-    def process_text_message(self, text: str) -> str:
+    async def process_text_message_async(self, text: str) -> str:
         try:
-            logger.info(f"Processing text: {text}")
+            logger.info("Processing text: %s", text)
             
-            greetings = ['hi', 'hello', 'hey', 'hii', 'hiii', 'good morning', 'good afternoon', 'good evening']
-            if text.lower().strip() in greetings:
-                return "Hello! 👋 I'm your AI assistant. Ask me anything about the knowledge base!"
+            canned = self.canned_reply(text)
+            if canned:
+                return canned
             
-            result = self.rag_engine.query(text)
+            vector, hit = self.lookup_response(text)
+            if hit:
+                return hit[0]
+            
+            async with self._rag_sem:
+                result = await self.rag_engine.query_async(text)
+            self.store_response(text, vector, result)
             return result['answer']
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
             return "Sorry, I encountered an error processing your message."
+    
+    def _warm_sync_pools(self):
+        for name, warm in (
+            ("AssemblyAI", lambda: aai.Client.get_default().http_client.head("/") if self._has_asr_key else None),
+            ("gTTS", lambda: PooledGTTS.SESSION.head(GTTS_ORIGIN, timeout=10))
+        ):
+            try:
+                warm()
+            except Exception as e:
+                logger.warning("%s connection warmup failed: %s", name, e)
+    
+    async def warmup(self):
+        async def warm_twilio_async():
+            try:
+                await http_client.head(TWILIO_API_ORIGIN)
+            except Exception as e:
+                logger.warning("Twilio connection warmup failed: %s", e)
+        
+        await asyncio.gather(
+            self.rag_engine.warmup(),
+            warm_twilio_async(),
+            asyncio.to_thread(self._warm_sync_pools)
+        )
+    
+    async def keep_connections_warm(self, interval: float = KEEPALIVE_INTERVAL):
+        while True:
+            await self.warmup()
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+    
+    async def aclose(self):
+        await http_client.aclose()
+        self.transcripts.close()
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False, cancel_futures=True)
+        if self.piper is not None:
+            self.piper.close()